@@ -0,0 +1,304 @@
+import argparse
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import queue
+import sys
+from pathlib import Path
+from typing import Callable
+
+from main import process_lines
+
+MANIFEST_FILE_NAME = "manifest.json"
+CHECKPOINT_FILE_NAME = "checkpoints.jsonl"
+RESULT_POLL_SECONDS = 1.0
+
+
+def plan_shards(input_path: Path, shard_size: int) -> tuple[list[dict], str]:
+    """
+    Split the input file into shards of `shard_size` consecutive lines.
+
+    Args:
+        input_path (Path): JSONL file, one list of operations per line.
+        shard_size (int): Maximum number of lines per shard.
+
+    Returns:
+        tuple[list[dict], str]: Shards in input order, and the SHA-256 hex digest
+        of the input. Each shard has its "index", the "first_line" it holds and
+        the "start"/"end" byte offsets in the file.
+    """
+    shards = []
+    line_number = 0
+    offset = 0
+    digest = hashlib.sha256()
+    with open(input_path, "rb") as input_file:
+        for line in input_file:
+            if line_number % shard_size == 0:
+                shards.append(
+                    {"index": len(shards), "first_line": line_number, "start": offset}
+                )
+            line_number += 1
+            offset += len(line)
+            shards[-1]["end"] = offset
+            digest.update(line)
+    return shards, digest.hexdigest()
+
+
+def shard_output_path(work_dir: Path, index: int) -> Path:
+    return work_dir / f"shard-{index:05d}.jsonl"
+
+
+def fsync_directory(path: Path) -> None:
+    """Make renames into `path` durable."""
+    directory_fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(directory_fd)
+    finally:
+        os.close(directory_fd)
+
+
+def is_shard_completed(work_dir: Path, shard: dict, checkpoint: dict | None) -> bool:
+    """Check that `checkpoint` is for this shard and its output is intact."""
+    if checkpoint is None or any(checkpoint.get(key) != shard[key] for key in shard):
+        return False
+    output_path = shard_output_path(work_dir, shard["index"])
+    return output_path.exists() and output_path.stat().st_size == checkpoint["output_size"]
+
+
+def load_checkpoints(work_dir: Path) -> dict[int, dict]:
+    """Read the completed shards recorded by a previous run, keyed by shard index."""
+    checkpoint_path = work_dir / CHECKPOINT_FILE_NAME
+    if not checkpoint_path.exists():
+        return {}
+
+    checkpoints = {}
+    with open(checkpoint_path) as checkpoint_file:
+        for line in checkpoint_file:
+            try:
+                shard = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash while appending may leave a truncated last line
+                continue
+            checkpoints[shard["index"]] = shard
+    return checkpoints
+
+
+def write_checkpoint(work_dir: Path, shard: dict) -> None:
+    """Durably record a shard as completed."""
+    with open(work_dir / CHECKPOINT_FILE_NAME, "a") as checkpoint_file:
+        checkpoint_file.write(json.dumps(shard) + "\n")
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+
+
+def rewrite_checkpoints(work_dir: Path, checkpoints: dict[int, dict]) -> None:
+    """Replace the checkpoint file with `checkpoints`, dropping any truncated record."""
+    checkpoint_path = work_dir / CHECKPOINT_FILE_NAME
+    partial_path = checkpoint_path.with_suffix(".partial")
+    with open(partial_path, "w") as checkpoint_file:
+        for shard in checkpoints.values():
+            checkpoint_file.write(json.dumps(shard) + "\n")
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(partial_path, checkpoint_path)
+    fsync_directory(work_dir)
+
+
+def check_manifest(work_dir: Path, input_sha256: str, shard_size: int) -> None:
+    """
+    Make sure `work_dir` only holds checkpoints for this input and shard size.
+
+    The input is identified by its content digest alone, so editing it in place
+    (even without changing its size) invalidates the checkpoints, while moving
+    or renaming it doesn't.
+
+    Raises:
+        ValueError: If the work dir was used for a different input or shard size.
+    """
+    manifest = {"input_sha256": input_sha256, "shard_size": shard_size}
+    manifest_path = work_dir / MANIFEST_FILE_NAME
+    if manifest_path.exists():
+        if json.loads(manifest_path.read_text()) != manifest:
+            raise ValueError(
+                f"{work_dir} holds checkpoints for a different input or shard size"
+            )
+        return
+
+    partial_path = manifest_path.with_suffix(".partial")
+    with open(partial_path, "w") as manifest_file:
+        manifest_file.write(json.dumps(manifest))
+        manifest_file.flush()
+        os.fsync(manifest_file.fileno())
+    os.replace(partial_path, manifest_path)
+    fsync_directory(work_dir)
+
+
+def run_shard(input_path: Path, work_dir: Path, shard: dict) -> int:
+    """
+    Calculate the taxes for every line of a shard and write them to its output file.
+
+    Returns:
+        int: Size in bytes of the shard output, stored with its checkpoint.
+    """
+    with open(input_path, "rb") as input_file:
+        input_file.seek(shard["start"])
+        data = input_file.read(shard["end"] - shard["start"])
+    # Read lines the way `main.py` reads stdin; `str.splitlines` would also
+    # split at characters JSON allows inside strings, like U+2028
+    lines = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8")
+
+    output_path = shard_output_path(work_dir, shard["index"])
+    partial_path = output_path.with_suffix(".partial")
+    with open(partial_path, "w") as output_file:
+        process_lines(lines, output=output_file)
+        output_file.flush()
+        os.fsync(output_file.fileno())
+        output_size = os.fstat(output_file.fileno()).st_size
+    os.replace(partial_path, output_path)
+    # The checkpoint written after this must never outlive the output it vouches for
+    fsync_directory(work_dir)
+    return output_size
+
+
+def worker(
+    shard_runner: Callable[[Path, Path, dict], int],
+    input_path: Path,
+    work_dir: Path,
+    tasks: multiprocessing.Queue,
+    results: multiprocessing.Queue,
+) -> None:
+    """Run shards from `tasks` until a `None` sentinel, reporting each finished shard."""
+    for shard in iter(tasks.get, None):
+        output_size = shard_runner(input_path, work_dir, shard)
+        results.put((shard["index"], output_size))
+
+
+def merge_shard_outputs(work_dir: Path, shards: list[dict], output_path: Path) -> None:
+    """Concatenate the shard outputs, in input order, into `output_path`."""
+    partial_path = output_path.with_name(output_path.name + ".partial")
+    with open(partial_path, "w") as output_file:
+        for shard in shards:
+            with open(shard_output_path(work_dir, shard["index"])) as shard_file:
+                output_file.write(shard_file.read())
+    os.replace(partial_path, output_path)
+
+
+def run_batch(
+    input_path: Path,
+    output_path: Path,
+    work_dir: Path,
+    shard_size: int = 1000,
+    workers: int | None = None,
+    shard_runner: Callable[[Path, Path, dict], int] = run_shard,
+) -> None:
+    """
+    Calculate the taxes for a JSONL file by sharding it across worker processes.
+
+    Each completed shard is checkpointed in `work_dir`, so running again with
+    the same arguments after a crash only computes the shards left unfinished.
+
+    Args:
+        input_path (Path): JSONL file, one list of operations per line.
+        output_path (Path): File the merged tax results are written to.
+        work_dir (Path): Directory for shard outputs and checkpoints.
+        shard_size (int): Maximum number of lines per shard.
+        workers (int, optional): Number of worker processes, defaults to the CPU count.
+        shard_runner (Callable, optional): Module-level function the workers call
+            to process a shard, `run_shard` by default.
+
+    Raises:
+        ValueError: If `shard_size` or `workers` isn't positive, or `work_dir` holds
+            checkpoints for another input or shard size.
+        RuntimeError: If the workers exit before every shard is completed.
+    """
+    if shard_size < 1:
+        raise ValueError("shard_size must be a positive integer")
+    if workers is not None and workers < 1:
+        raise ValueError("workers must be a positive integer")
+    input_path, output_path, work_dir = Path(input_path), Path(output_path), Path(work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    shards, input_sha256 = plan_shards(input_path, shard_size)
+    check_manifest(work_dir, input_sha256, shard_size)
+
+    checkpoints = load_checkpoints(work_dir)
+    rewrite_checkpoints(work_dir, checkpoints)
+    pending = [
+        shard
+        for shard in shards
+        if not is_shard_completed(work_dir, shard, checkpoints.get(shard["index"]))
+    ]
+
+    if pending:
+        tasks = multiprocessing.Queue()
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=worker,
+                args=(shard_runner, input_path, work_dir, tasks, results),
+            )
+            for _ in range(min(workers or os.cpu_count() or 1, len(pending)))
+        ]
+        for process in processes:
+            process.start()
+        for shard in pending:
+            tasks.put(shard)
+        for _ in processes:
+            tasks.put(None)
+
+        remaining = {shard["index"]: shard for shard in pending}
+        try:
+            while remaining:
+                # Checked before waiting: anything a dead worker sent is already queued
+                workers_alive = any(process.is_alive() for process in processes)
+                try:
+                    index, output_size = results.get(timeout=RESULT_POLL_SECONDS)
+                except queue.Empty:
+                    if workers_alive:
+                        continue
+                    raise RuntimeError(
+                        f"Workers exited with {len(remaining)} shard(s) unfinished, "
+                        "run again to resume"
+                    )
+                write_checkpoint(
+                    work_dir, {**remaining.pop(index), "output_size": output_size}
+                )
+        finally:
+            if remaining:
+                # Shards nobody will read can keep the queue's feeder thread blocked
+                # on a full pipe, which would stop this process from ever exiting
+                tasks.cancel_join_thread()
+            for process in processes:
+                if remaining:
+                    process.terminate()
+                process.join()
+
+    merge_shard_outputs(work_dir, shards, output_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Calculate taxes for a JSONL file using sharded worker processes."
+    )
+    parser.add_argument("input", type=Path, help="JSONL file, one list of operations per line")
+    parser.add_argument("output", type=Path, help="file the tax results are written to")
+    parser.add_argument(
+        "--work-dir",
+        type=Path,
+        required=True,
+        help="directory for shard outputs and checkpoints, reuse it to resume a run",
+    )
+    parser.add_argument("--shard-size", type=int, default=1000, help="lines per shard")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes")
+    args = parser.parse_args()
+
+    try:
+        run_batch(args.input, args.output, args.work_dir, args.shard_size, args.workers)
+    except (ValueError, RuntimeError) as e:
+        print(f"Error running batch: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import argparse
 import json
 import sys
 from decimal import Decimal
@@ -10,10 +11,13 @@ from calculations import (
     calculate_weighted_avg,
 )
 from tax_operations_constants import TAX_FREE_LARGE_OPERATIONS_THRESHOLD, TAX_OVERSELL_ERROR_MESSAGE
+from utils.audit_trail import PositionAuditTrail
 from utils.json_utils import decimal_default
 
 
-def orchestrator(operation_list: list[dict]) -> list[dict]:
+def orchestrator(
+    operation_list: list[dict], audit_trail: PositionAuditTrail | None = None
+) -> list[dict]:
     """
     Calculate taxes owed for a sequence of market operations.
 
@@ -22,6 +26,8 @@ def orchestrator(operation_list: list[dict]) -> list[dict]:
             - "operation": either "buy" or "sell"
             - "unit-cost": float, cost per share
             - "quantity": int, number of shares
+        audit_trail (PositionAuditTrail, optional): When given, the current position
+            (weighted average, share quantity and loss) is recorded after each operation.
 
     Returns:
         str (JSON): List of dicts with tax values for each operation, serialized to JSON.
@@ -35,13 +41,17 @@ def orchestrator(operation_list: list[dict]) -> list[dict]:
     }
     # First value for tax will always be zero
     output_values = [{"tax": Decimal(0)}]
+    if audit_trail is not None:
+        audit_trail.record(0, current_position)
 
-    for operation in operation_list[1:]:
+    for operation_index, operation in enumerate(operation_list[1:], start=1):
         tax = 0
 
         if operation["operation"] == "sell":
             if operation["quantity"] > current_position["share_quantity"]:
                 output_values.append({"error": TAX_OVERSELL_ERROR_MESSAGE})
+                if audit_trail is not None:
+                    audit_trail.record(operation_index, current_position)
                 continue
 
             operation_profit_or_loss = calculate_sell_operation_profit_or_loss(
@@ -80,21 +90,48 @@ def orchestrator(operation_list: list[dict]) -> list[dict]:
             current_position["share_quantity"] += operation["quantity"]
 
         output_values.append({"tax": Decimal(tax)})
+        if audit_trail is not None:
+            audit_trail.record(operation_index, current_position)
 
     return json.dumps(output_values, default=decimal_default)
 
 
-def main():
-    for line in sys.stdin:
+def process_lines(lines, output=None, audit_trail: PositionAuditTrail | None = None):
+    for line_number, line in enumerate(lines, start=1):
         line = line.strip()
         if not line:
             continue
         try:
+            if audit_trail is not None:
+                audit_trail.start_line(line_number)
             operation_list = json.loads(line)
-            tax_result = orchestrator(operation_list)
-            print(tax_result)
+            tax_result = orchestrator(operation_list, audit_trail=audit_trail)
+            print(tax_result, file=output)
         except Exception as e:
+            if audit_trail is not None:
+                # Snapshots of a line that failed partway would be misleading
+                audit_trail.rollback()
             print(f"Error processing line: {e}", file=sys.stderr)
+        else:
+            if audit_trail is not None:
+                audit_trail.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calculate taxes on market operations.")
+    parser.add_argument(
+        "--audit-trail",
+        metavar="FILE",
+        help="write the position after each operation to FILE as gzip-compressed chunks",
+    )
+    args = parser.parse_args()
+
+    if args.audit_trail is None:
+        process_lines(sys.stdin)
+        return
+
+    with open(args.audit_trail, "wb") as stream, PositionAuditTrail(stream) as audit_trail:
+        process_lines(sys.stdin, audit_trail=audit_trail)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,148 @@
+import io
+import json
+import subprocess
+import sys
+from decimal import Decimal
+from pathlib import Path
+
+import pytest
+
+from main import orchestrator, process_lines
+from utils.audit_trail import PositionAuditTrail, iter_audit_trail
+
+
+def run_with_audit_trail(operations: list[dict], chunk_size: int = 4096):
+    stream = io.BytesIO()
+    with PositionAuditTrail(stream, chunk_size=chunk_size) as audit_trail:
+        result = json.loads(orchestrator(operations, audit_trail=audit_trail))
+    stream.seek(0)
+    return result, list(iter_audit_trail(stream))
+
+
+def process_lines_with_audit_trail(lines: list[str], chunk_size: int = 4096):
+    stream, output = io.BytesIO(), io.StringIO()
+    with PositionAuditTrail(stream, chunk_size=chunk_size) as audit_trail:
+        process_lines(lines, output=output, audit_trail=audit_trail)
+    stream.seek(0)
+    return output.getvalue().splitlines(), stream.getvalue(), list(iter_audit_trail(stream))
+
+
+def test_audit_trail_records_position_after_each_operation():
+    """Test that the position snapshot is recorded after every operation"""
+    operations = [
+        {"operation": "buy", "unit-cost": 10.00, "quantity": 10000},
+        {"operation": "buy", "unit-cost": 20.00, "quantity": 10000},
+        {"operation": "sell", "unit-cost": 5.00, "quantity": 5000},
+    ]
+    _, snapshots = run_with_audit_trail(operations)
+    assert [
+        (s["operation_index"], s["weighted_average"], s["share_quantity"], s["loss"])
+        for s in snapshots
+    ] == [
+        (0, "10.00", 10000, "0.00"),
+        (1, "15.00", 20000, "0.00"),
+        (2, "15.00", 15000, "50000.00"),
+    ]
+    # Not going through `process_lines`, so no line number was set
+    assert {s["line_number"] for s in snapshots} == {0}
+
+
+def test_audit_trail_records_unchanged_position_on_oversell():
+    """Test that an oversell error still records the (unchanged) position"""
+    operations = [
+        {"operation": "buy", "unit-cost": 10.00, "quantity": 100},
+        {"operation": "sell", "unit-cost": 12.00, "quantity": 1000},
+    ]
+    result, snapshots = run_with_audit_trail(operations)
+    assert result[1] == {"error": "Can't sell more stocks than you have"}
+    assert snapshots[1] == snapshots[0] | {"operation_index": 1}
+
+
+def test_audit_trail_does_not_change_tax_output():
+    """Test that enabling the audit trail keeps the tax output identical"""
+    operations = [
+        {"operation": "buy", "unit-cost": 10.00, "quantity": 10000},
+        {"operation": "sell", "unit-cost": 20.00, "quantity": 5000},
+        {"operation": "sell", "unit-cost": 5.00, "quantity": 5000},
+    ]
+    result, _ = run_with_audit_trail(operations)
+    assert result == json.loads(orchestrator(operations))
+
+
+def test_audit_trail_writes_multiple_chunks():
+    """Test that snapshots spanning several chunks are read back in order"""
+    operations = [{"operation": "buy", "unit-cost": 10.00, "quantity": 1}] * 5
+    lines = [json.dumps(operations)] * 4
+    _, data, snapshots = process_lines_with_audit_trail(lines, chunk_size=3)
+    # Each gzip member starts with the same magic bytes
+    assert data.count(b"\x1f\x8b") > 1
+    assert [s["operation_index"] for s in snapshots] == list(range(5)) * 4
+    assert [s["line_number"] for s in snapshots] == [1] * 5 + [2] * 5 + [3] * 5 + [4] * 5
+    assert snapshots[-1]["share_quantity"] == 5
+    assert snapshots[-1]["weighted_average"] == str(Decimal("10.00"))
+
+
+def test_audit_trail_drops_snapshots_of_failed_line():
+    """Test that a line failing partway leaves no snapshots behind"""
+    lines = [
+        '[{"operation": "buy", "unit-cost": 10.00, "quantity": 100}]',
+        '[{"operation": "buy", "unit-cost": 10.00, "quantity": 100}, {"operation": "buy", "quantity": 1}]',
+        "",
+        '[{"operation": "buy", "unit-cost": 20.00, "quantity": 50}]',
+    ]
+    output, _, snapshots = process_lines_with_audit_trail(lines, chunk_size=1)
+    assert len(output) == 2
+    assert [(s["line_number"], s["weighted_average"]) for s in snapshots] == [
+        (1, "10.00"),
+        (4, "20.00"),
+    ]
+
+
+def test_audit_trail_rejects_invalid_chunk_size():
+    """Test that a non-positive chunk size is rejected"""
+    with pytest.raises(ValueError):
+        PositionAuditTrail(io.BytesIO(), chunk_size=0)
+
+
+@pytest.mark.parametrize("quantity", [100.0, 2**64])
+def test_audit_trail_accepts_any_quantity(quantity):
+    """Test that quantities outside int64 (floats, big ints) don't fail the line"""
+    operations = [{"operation": "buy", "unit-cost": 10.00, "quantity": quantity}]
+    result, snapshots = run_with_audit_trail(operations)
+    assert result == json.loads(orchestrator(operations))
+    assert snapshots[0]["share_quantity"] == quantity
+
+
+def test_audit_trail_rounds_money_like_tax_output():
+    """Test that unquantized values are rounded half up, like `decimal_default`"""
+    operations = [{"operation": "buy", "unit-cost": 0.125, "quantity": 100}]
+    _, snapshots = run_with_audit_trail(operations)
+    assert snapshots[0]["weighted_average"] == "0.13"
+    assert snapshots[0]["loss"] == "0.00"
+
+
+def test_main_writes_audit_trail_file(tmp_path):
+    """Test that `main.py --audit-trail FILE` writes a trail readable with `iter_audit_trail`"""
+    audit_path = tmp_path / "audit.jsonl.gz"
+    input_text = (
+        '[{"operation": "buy", "unit-cost": 10.00, "quantity": 10000}, '
+        '{"operation": "sell", "unit-cost": 20.00, "quantity": 5000}]\n'
+        '[{"operation": "buy", "unit-cost": 20.00, "quantity": 100}]\n'
+    )
+    result = subprocess.run(
+        [sys.executable, "main.py", "--audit-trail", str(audit_path)],
+        input=input_text.encode(),
+        stdout=subprocess.PIPE,
+        cwd=Path(__file__).parent.parent,
+    )
+    assert result.stdout.decode().splitlines() == [
+        '[{"tax": "0.00"}, {"tax": "10000.00"}]',
+        '[{"tax": "0.00"}]',
+    ]
+    with open(audit_path, "rb") as stream:
+        snapshots = list(iter_audit_trail(stream))
+    assert [(s["line_number"], s["operation_index"], s["share_quantity"]) for s in snapshots] == [
+        (1, 0, 10000),
+        (1, 1, 5000),
+        (2, 0, 100),
+    ]
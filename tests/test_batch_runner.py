@@ -0,0 +1,227 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import batch_runner
+from batch_runner import load_checkpoints, plan_shards, run_batch, shard_output_path
+from main import orchestrator
+
+OPERATION_LISTS = [
+    [
+        {"operation": "buy", "unit-cost": 10.00, "quantity": 10000},
+        {"operation": "sell", "unit-cost": 20.00, "quantity": 5000 + i},
+    ]
+    for i in range(7)
+]
+
+
+@pytest.fixture
+def input_path(tmp_path):
+    path = tmp_path / "input.jsonl"
+    path.write_text("".join(json.dumps(ops) + "\n" for ops in OPERATION_LISTS))
+    return path
+
+
+def expected_output() -> str:
+    return "".join(orchestrator(ops) + "\n" for ops in OPERATION_LISTS)
+
+
+# Module level so workers can import them whatever the start method
+def crash_on_second_shard(input_path, work_dir, shard):
+    """Stand-in for `run_shard` whose worker dies on shard 1, like a lost node"""
+    if shard["index"] == 1:
+        os._exit(1)
+    return batch_runner.run_shard(input_path, work_dir, shard)
+
+
+def crash_on_every_shard(input_path, work_dir, shard):
+    """Stand-in for `run_shard` whose worker dies right away"""
+    os._exit(1)
+
+
+def test_plan_shards_splits_by_line_ranges(input_path):
+    """Test that shards cover consecutive line ranges of the input"""
+    shards, _ = plan_shards(input_path, shard_size=3)
+    assert [shard["first_line"] for shard in shards] == [0, 3, 6]
+    assert shards[0]["start"] == 0
+    assert shards[-1]["end"] == input_path.stat().st_size
+    assert all(a["end"] == b["start"] for a, b in zip(shards, shards[1:]))
+
+
+def test_run_batch_merges_shards_in_order(input_path, tmp_path):
+    """Test that the merged output matches processing the lines sequentially"""
+    output_path = tmp_path / "output.jsonl"
+    run_batch(input_path, output_path, tmp_path / "work", shard_size=2, workers=3)
+    assert output_path.read_text() == expected_output()
+    assert sorted(load_checkpoints(tmp_path / "work")) == [0, 1, 2, 3]
+
+
+def test_run_batch_resume_skips_completed_shards(input_path, tmp_path):
+    """Test that a rerun only recomputes shards without a checkpoint"""
+    work_dir = tmp_path / "work"
+    output_path = tmp_path / "output.jsonl"
+    run_batch(input_path, output_path, work_dir, shard_size=2, workers=2)
+
+    # Tag a completed shard, keeping its size, so recomputing it would be noticed
+    kept = "k" * (shard_output_path(work_dir, 0).stat().st_size - 1)
+    shard_output_path(work_dir, 0).write_text(kept + "\n")
+    # Drop the last checkpoint as if the run crashed before recording it
+    checkpoint_path = work_dir / batch_runner.CHECKPOINT_FILE_NAME
+    checkpoint_lines = [
+        line
+        for line in checkpoint_path.read_text().splitlines(keepends=True)
+        if json.loads(line)["index"] != 3
+    ]
+    checkpoint_path.write_text("".join(checkpoint_lines) + '{"index": ')
+
+    run_batch(input_path, output_path, work_dir, shard_size=2, workers=2)
+    output_lines = output_path.read_text().splitlines()
+    assert output_lines[0] == kept
+    assert output_lines[1:] == expected_output().splitlines()[2:]
+    assert 3 in load_checkpoints(work_dir)
+
+
+def test_run_batch_recomputes_truncated_shard_output(input_path, tmp_path):
+    """Test that a checkpointed shard whose output lost data is computed again"""
+    work_dir = tmp_path / "work"
+    output_path = tmp_path / "output.jsonl"
+    run_batch(input_path, output_path, work_dir, shard_size=2, workers=2)
+
+    # As left by a power loss after the checkpoint but before the data hit disk
+    shard_output_path(work_dir, 1).write_text("")
+    run_batch(input_path, output_path, work_dir, shard_size=2, workers=2)
+    assert output_path.read_text() == expected_output()
+
+
+def test_run_batch_crashed_worker_can_resume(input_path, tmp_path):
+    """Test that a crashed worker fails the run and the next run completes it"""
+    work_dir = tmp_path / "work"
+    output_path = tmp_path / "output.jsonl"
+    with pytest.raises(RuntimeError):
+        run_batch(
+            input_path,
+            output_path,
+            work_dir,
+            shard_size=2,
+            workers=2,
+            shard_runner=crash_on_second_shard,
+        )
+    assert 1 not in load_checkpoints(work_dir)
+    assert not output_path.exists()
+
+    completed = {
+        index: shard_output_path(work_dir, index).stat().st_mtime_ns
+        for index in load_checkpoints(work_dir)
+    }
+    run_batch(input_path, output_path, work_dir, shard_size=2, workers=2)
+    assert output_path.read_text() == expected_output()
+    for index, mtime in completed.items():
+        assert shard_output_path(work_dir, index).stat().st_mtime_ns == mtime
+
+
+def test_run_batch_rejects_work_dir_for_other_shard_size(input_path, tmp_path):
+    """Test that checkpoints aren't reused with a different shard size"""
+    work_dir = tmp_path / "work"
+    run_batch(input_path, tmp_path / "output.jsonl", work_dir, shard_size=2, workers=1)
+    with pytest.raises(ValueError):
+        run_batch(input_path, tmp_path / "output.jsonl", work_dir, shard_size=3, workers=1)
+
+
+def test_run_batch_rejects_work_dir_for_edited_input(tmp_path):
+    """Test that checkpoints aren't reused after the input is edited in place"""
+    input_path = tmp_path / "input.jsonl"
+    operations = [
+        {"operation": "buy", "unit-cost": 10, "quantity": 9000},
+        {"operation": "sell", "unit-cost": 90, "quantity": 9000},
+    ]
+    input_path.write_text(json.dumps(operations) + "\n")
+    work_dir = tmp_path / "work"
+    run_batch(input_path, tmp_path / "output.jsonl", work_dir, shard_size=1, workers=1)
+
+    # Same byte size, different sell price
+    operations[1]["unit-cost"] = 20
+    edited = json.dumps(operations) + "\n"
+    assert len(edited) == input_path.stat().st_size
+    input_path.write_text(edited)
+    with pytest.raises(ValueError):
+        run_batch(input_path, tmp_path / "output.jsonl", work_dir, shard_size=1, workers=1)
+
+
+CRASH_WITH_MANY_PENDING_SHARDS = """
+import json
+import sys
+
+from batch_runner import run_batch
+from test_batch_runner import crash_on_every_shard
+
+input_path, work_dir = sys.argv[1:]
+line = json.dumps([{"operation": "buy", "unit-cost": 10, "quantity": 1}]) + "\\n"
+with open(input_path, "w") as input_file:
+    input_file.write(line * 3000)
+try:
+    run_batch(
+        input_path,
+        input_path + ".out",
+        work_dir,
+        shard_size=1,
+        workers=2,
+        shard_runner=crash_on_every_shard,
+    )
+except RuntimeError:
+    sys.exit(3)
+"""
+
+
+def test_run_batch_exits_after_crash_with_many_pending_shards(tmp_path):
+    """Test that unread shards left in the task queue don't keep the process alive"""
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            CRASH_WITH_MANY_PENDING_SHARDS,
+            str(tmp_path / "input.jsonl"),
+            str(tmp_path / "work"),
+        ],
+        cwd=Path(batch_runner.__file__).parent,
+        env={**os.environ, "PYTHONPATH": str(Path(__file__).parent)},
+        timeout=60,
+    )
+    assert result.returncode == 3
+
+
+@pytest.mark.parametrize("workers", [0, -1])
+def test_run_batch_rejects_non_positive_workers(input_path, tmp_path, workers):
+    """Test that a non-positive number of workers is rejected"""
+    with pytest.raises(ValueError):
+        run_batch(input_path, tmp_path / "output.jsonl", tmp_path / "work", workers=workers)
+
+
+def test_run_batch_keeps_unicode_line_separators_inside_lines(tmp_path):
+    """Test that only newlines split the input, as when `main.py` reads stdin"""
+    input_path = tmp_path / "input.jsonl"
+    operations = [
+        {"operation": "buy", "unit-cost": 10.00, "quantity": 100, "note": "a\u2028b\u0085c\x0cd"},
+        {"operation": "sell", "unit-cost": 10.00, "quantity": 100},
+    ]
+    input_path.write_text(json.dumps(operations, ensure_ascii=False) + "\n", encoding="utf-8")
+    output_path = tmp_path / "output.jsonl"
+    run_batch(input_path, output_path, tmp_path / "work", shard_size=1, workers=1)
+    assert output_path.read_text() == orchestrator(operations) + "\n"
+
+
+def test_run_batch_reuses_checkpoints_for_moved_input(input_path, tmp_path):
+    """Test that checkpoints follow the input's content, not its path"""
+    work_dir = tmp_path / "work"
+    output_path = tmp_path / "output.jsonl"
+    run_batch(input_path, output_path, work_dir, shard_size=2, workers=2)
+
+    # Tag a completed shard, keeping its size, so recomputing it would be noticed
+    kept = "k" * (shard_output_path(work_dir, 0).stat().st_size - 1)
+    shard_output_path(work_dir, 0).write_text(kept + "\n")
+    moved_path = input_path.rename(tmp_path / "renamed.jsonl")
+    run_batch(moved_path, output_path, work_dir, shard_size=2, workers=2)
+    assert output_path.read_text().splitlines()[0] == kept
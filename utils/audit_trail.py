@@ -0,0 +1,140 @@
+import gzip
+import json
+from array import array
+from decimal import ROUND_HALF_UP, Decimal, localcontext
+from functools import lru_cache
+from typing import BinaryIO, Iterator
+
+AUDIT_TRAIL_COLUMNS = (
+    "line_number",
+    "operation_index",
+    "weighted_average",
+    "share_quantity",
+    "loss",
+)
+# Chunks are small and written often, so speed matters more than ratio here
+AUDIT_TRAIL_COMPRESS_LEVEL = 1
+
+
+@lru_cache(maxsize=1024)
+def _format_money(value) -> str:
+    """Format a monetary value the same way `decimal_default` does."""
+    with localcontext() as ctx:
+        ctx.rounding = ROUND_HALF_UP
+        return f"{value:.2f}"
+
+
+def _format_money_column(values: list) -> list[str]:
+    """Format a column of monetary values, most of them already quantized."""
+    # `round_decimal_output` already quantized nearly every value, so `str` is
+    # enough; the rest are mostly zero losses or the first weighted average
+    return [
+        text if (text := str(value))[-3:-2] == "." else _format_money(value)
+        for value in values
+    ]
+
+
+class PositionAuditTrail:
+    """
+    Records the `current_position` after each operation into columnar buffers.
+
+    The buffers are preallocated with `chunk_size` rows, so recording a snapshot
+    is just a few slot assignments; formatting only happens once per chunk.
+    Snapshots are kept per input line: `start_line` sets the line number stored
+    with the following snapshots, `commit` keeps the ones recorded since
+    the last commit and `rollback` drops them, so a line that fails partway
+    leaves nothing behind. Once a commit fills a chunk it's serialized as one
+    JSON line of columns and written to `stream` as an individual gzip member,
+    which keeps the whole stream readable with `gzip.open`.
+
+    Args:
+        stream (BinaryIO): Binary stream the compressed chunks are written to.
+        chunk_size (int): Number of snapshots buffered before a chunk is written.
+    """
+
+    def __init__(self, stream: BinaryIO, chunk_size: int = 4096):
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be a positive integer")
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self._line_number = array("q")
+        self._operation_index = array("q")
+        # A plain list, like the Decimal columns, so any quantity the tax
+        # calculation accepts (floats, big ints) can be recorded too
+        self._share_quantity = []
+        self._weighted_average = []
+        self._loss = []
+        self._capacity = 0
+        self._grow()
+        self._size = 0
+        self._committed = 0
+        self._current_line_number = 0
+
+    def _grow(self) -> None:
+        """Add `chunk_size` rows to every buffer, for lines that overflow a chunk."""
+        self._line_number += array("q", bytes(8 * self.chunk_size))
+        self._operation_index += array("q", bytes(8 * self.chunk_size))
+        self._share_quantity += [0] * self.chunk_size
+        self._weighted_average += [Decimal(0)] * self.chunk_size
+        self._loss += [Decimal(0)] * self.chunk_size
+        self._capacity += self.chunk_size
+
+    def start_line(self, line_number: int) -> None:
+        """Set the input line number stored with the snapshots recorded from now on."""
+        self._current_line_number = line_number
+
+    def record(self, operation_index: int, current_position: dict) -> None:
+        """Store a snapshot of the position right after `operation_index`."""
+        row = self._size
+        if row == self._capacity:
+            self._grow()
+        self._line_number[row] = self._current_line_number
+        self._operation_index[row] = operation_index
+        self._weighted_average[row] = current_position["weighted_average"]
+        self._share_quantity[row] = current_position["share_quantity"]
+        self._loss[row] = current_position["loss"]
+        self._size = row + 1
+
+    def commit(self) -> None:
+        """Keep the snapshots recorded since the last commit, writing a chunk once full."""
+        self._committed = self._size
+        if self._size >= self.chunk_size:
+            self.flush()
+
+    def rollback(self) -> None:
+        """Drop the snapshots recorded since the last commit."""
+        self._size = self._committed
+
+    def flush(self) -> None:
+        """Write the buffered snapshots as a compressed chunk and reset the buffers."""
+        if not self._size:
+            return
+        size = self._size
+        chunk = {
+            "line_number": self._line_number[:size].tolist(),
+            "operation_index": self._operation_index[:size].tolist(),
+            "weighted_average": _format_money_column(self._weighted_average[:size]),
+            "share_quantity": self._share_quantity[:size],
+            "loss": _format_money_column(self._loss[:size]),
+        }
+        line = json.dumps(chunk) + "\n"
+        self.stream.write(
+            gzip.compress(line.encode(), compresslevel=AUDIT_TRAIL_COMPRESS_LEVEL)
+        )
+        self._size = 0
+        self._committed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+
+def iter_audit_trail(stream: BinaryIO) -> Iterator[dict]:
+    """Yield each recorded snapshot, as a dict, from a stream written by `PositionAuditTrail`."""
+    with gzip.open(stream, "rt") as chunks:
+        for line in chunks:
+            chunk = json.loads(line)
+            for row in zip(*(chunk[column] for column in AUDIT_TRAIL_COLUMNS)):
+                yield dict(zip(AUDIT_TRAIL_COLUMNS, row))